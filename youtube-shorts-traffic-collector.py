@@ -5,7 +5,7 @@
 # Runs packet capture (Scapy) in a background thread while Selenium watches/skips Shorts.
 
 # Key points:
-# - Reliable stop behavior: sniff() may block if traffic is silent, so we loop with timeout.
+# - Reliable stop behavior: the capture socket is polled with select() and a short timeout (works on silence).
 # - Configurable behavior via CLI flags (watch probability, half/full mode, pauses, shorts per cycle).
 
 from __future__ import annotations
@@ -16,19 +16,21 @@ import argparse  # CLI params.
 import logging
 import os  # mkdir/root user.
 import random
+import select  # Wait on the capture socket with a short timeout.
+import socket
 import threading
 import time
 from typing import Tuple, Optional, List
 
-from scapy.all import sniff, wrpcap  # sniff() for capture / wrpcap() to write .pcap files.
+from scapy.all import RawPcapWriter, conf  # conf.L2listen for capture / RawPcapWriter to stream .pcap files.
+from scapy.data import DLT_EN10MB
+from scapy.supersocket import SuperSocket
 
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import WebDriverException, TimeoutException
 
 
@@ -39,6 +41,11 @@ logger = logging.getLogger("youtube_shorts_traffic_collector")
 # Global flag used to stop capture thread.
 stop_capture_flag = threading.Event()
 
+# Set by the capture thread once it is reading packets.
+capture_ready_flag = threading.Event()
+
+SO_RCVBUFFORCE = 33  # Linux, not exported by the socket module.
+
 
 # Aux.
 def rand_range(r: Tuple[float, float]) -> float:
@@ -54,7 +61,8 @@ def randint_range(r: Tuple[int, int]) -> int:
 # Default human-like behavior (adjust via CLI).
 @dataclass(frozen=True)
 class Behavior:
-    # Page load / initial settle time.
+    # Page load / initial settle time (only applied when page_load_pause is enabled).
+    page_load_pause: bool = False
     page_load_wait_s: Tuple[float, float] = (2.0, 4.5)
 
     # Between-actions pause.
@@ -81,7 +89,7 @@ class Behavior:
 
 
 # Create the default Selenium driver.
-def build_driver(headless: bool, chromedriver_path: Optional[str]) -> webdriver.Chrome:
+def build_driver(headless: bool, chromedriver_path: Optional[str], block_images: bool = False) -> webdriver.Chrome:
     options = Options()
     if headless:
         options.add_argument("--headless=new")
@@ -90,33 +98,154 @@ def build_driver(headless: bool, chromedriver_path: Optional[str]) -> webdriver.
     options.add_argument("--mute-audio")
     options.add_argument("--lang=pt-BR")
 
+    # Faster startup and less background (non-YouTube) traffic in the capture.
+    options.add_argument("--disable-gpu")
+    options.add_argument("--disable-extensions")
+    options.add_argument("--disable-background-networking")
+    options.add_argument("--disable-sync")
+    options.add_argument("--disable-default-apps")
+    options.add_argument("--disable-breakpad")
+    options.add_argument("--disable-features=TranslateUI,OptimizationHints")
+
+    # Images change the captured traffic profile, so blocking them is opt-in.
+    if block_images:
+        options.add_argument("--blink-settings=imagesEnabled=false")
+        options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+
     service = Service(chromedriver_path) if chromedriver_path else Service()
     driver = webdriver.Chrome(service=service, options=options)
     driver.set_window_size(1280, 720)
+
+    # Page helpers installed in every new document (Chrome DevTools Protocol):
+    # - __shortsReady resolves once YouTube has registered the Shorts player element.
+    # - __bootstrap waits for it, accepts cookies (PT/EN) and starts the video (muted), all in-page.
+    driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": """
+        window.__shortsReady = (location.hostname === 'www.youtube.com' && window.customElements)
+            ? customElements.whenDefined('ytd-reel-video-renderer')
+            : Promise.resolve();
+
+        window.__bootstrap = async (timeoutMs, clickCookies) => {
+            const deadline = performance.now() + timeoutMs;
+            const sleep = (ms) => new Promise(r => setTimeout(r, ms));
+            // Short head-start only: if the player element is never defined, still poll for the video.
+            await Promise.race([window.__shortsReady, sleep(Math.min(2000, timeoutMs))]);
+
+            while (performance.now() < deadline) {
+                // Click the consent button at most once and return right away: the click may
+                // navigate (consent page), so the caller runs the bootstrap again without clicking.
+                if (clickCookies) {
+                    // Visible, enabled buttons only (hidden leftovers must not count as a consent dialog).
+                    const btn = [...document.querySelectorAll('button, tp-yt-paper-button')]
+                        .find(b => /Aceitar|Accept/.test(b.textContent)
+                            && !b.disabled && b.getClientRects().length > 0);
+                    if (btn) { btn.click(); return {video: false, cookies: true}; }
+                }
+
+                const v = document.querySelector('video');
+                if (v) {
+                    v.muted = true;
+                    // Not awaited: play() may stay pending while the video buffers.
+                    try { const p = v.play(); if (p) { p.catch(() => {}); } } catch (e) {}
+                    return {video: true, cookies: false};
+                }
+                await sleep(100);
+            }
+            return {video: false, cookies: false};
+        };
+    """})
     return driver
 
 
 # Packet capture.
-def capture_packets(interface: str, filename: str, bpf_filter: str, poll_timeout_s: float = 1.0) -> None:
-    # Capture packets on the given interface using a BPF filter until stop_capture_flag is set.
-    # NOTE: sniff(stop_filter=...) only checks stop when packets arrive -> may hang on silence.
-    # Looping with timeout makes stopping reliable.
-
-    logger.info("Starting capture on interface=%s | filter='%s'", interface, bpf_filter)
-    captured: list = []
+def open_capture_socket(interface: str, bpf_filter: str, rcvbuf_bytes: int = 32 << 20) -> SuperSocket:
+    # Open the listening socket once per run: the BPF filter is compiled/attached a single time
+    # and the same socket is reused by every cycle.
+    logger.info("Opening capture socket on interface=%s | filter='%s'", interface, bpf_filter)
+    listen_socket = conf.L2listen(iface=interface, filter=bpf_filter)
+
+    # Large kernel receive buffer (AF_PACKET on Linux) so bursts are queued instead of dropped
+    # while the capture thread is busy. SO_RCVBUFFORCE (root only) ignores net.core.rmem_max.
+    try:
+        listen_socket.ins.setsockopt(socket.SOL_SOCKET, SO_RCVBUFFORCE, rcvbuf_bytes)
+    except (AttributeError, OSError) as e:
+        logger.warning("Could not enlarge capture socket buffer: %s", e)
+
+    return listen_socket
+
+
+def capture_packets(
+    listen_socket: SuperSocket,
+    filename: str,
+    snaplen: int = 0,
+    select_timeout_s: float = 0.05,
+    write_buffer_bytes: int = 1 << 20,
+) -> None:
+    # Capture packets from the shared listening socket until stop_capture_flag is set.
+    # The socket is read directly: select() returns as soon as a packet is queued, and its short
+    # timeout lets the loop notice stop_capture_flag quickly even on silence.
+
+    logger.info("Starting capture -> %s", filename)
+
+    # Packets queued on the socket between cycles belong to the previous gap, not this cycle.
+    started = time.time()
+
+    # Packets are written as they arrive (not kept in memory until the end of the cycle).
+    # Raw bytes only: the payload is encrypted, so there is no point in dissecting it with Scapy.
+    # Records go through one large file buffer -> few write() calls, no per-packet Python objects kept.
+    # snaplen > 0 keeps only the first snaplen bytes of each packet (original length is still recorded).
+    # The link type comes from the socket (set when it was opened), and the global header is written
+    # up front: write_packet() alone never writes it.
+    writer = RawPcapWriter(
+        open(filename, "wb", buffering=write_buffer_bytes),
+        linktype=conf.l2types.layer2num.get(getattr(listen_socket, "LL", None), DLT_EN10MB),
+        sync=False,
+        snaplen=snaplen if snaplen > 0 else 65535,
+    )
+    count = 0
 
     try:
+        writer.write_header(None)
+        capture_ready_flag.set()
+
         while not stop_capture_flag.is_set():
-            pkts = sniff(iface=interface, filter=bpf_filter, timeout=poll_timeout_s)
-            if pkts:
-                captured.extend(pkts)
+            readable, _, _ = select.select([listen_socket], [], [], select_timeout_s)
+            if not readable:
+                continue
+
+            _, data, ts = listen_socket.recv_raw()
+            if not data:
+                continue
+            if ts is None:
+                ts = time.time()
+            if ts < started:
+                continue
+
+            wirelen = len(data)
+            if 0 < snaplen < wirelen:
+                data = data[:snaplen]
 
-        wrpcap(filename, captured)
-        logger.info("Capture finished. Saved %d packets to %s", len(captured), filename)
+            sec = int(ts)
+            writer.write_packet(data, sec=sec, usec=int((ts - sec) * 1_000_000), caplen=len(data), wirelen=wirelen)
+            count += 1
+
+        logger.info("Capture finished. Saved %d packets to %s", count, filename)
 
     except Exception as e:
         logger.exception("Capture error: %s", e)
 
+    finally:
+        writer.close()
+
+
+def join_capture_thread(capture_thread: threading.Thread, timeout_s: float = 30.0) -> bool:
+    # Join with a timeout so a stuck capture thread is reported instead of waiting on it forever.
+    # Returns True if the thread is still alive (main() then aborts the run with a hard exit).
+    capture_thread.join(timeout=timeout_s)
+    if capture_thread.is_alive():
+        logger.error("Capture thread still running after %.0fs (stuck on socket/disk?).", timeout_s)
+        return True
+    return False
+
 
 # Shorts simulation.
 def maybe_idle(behavior: Behavior) -> None:
@@ -127,44 +256,63 @@ def maybe_idle(behavior: Behavior) -> None:
         time.sleep(t)
 
 
+def bootstrap_shorts(driver: webdriver.Chrome, timeout_s: float, click_cookies: bool) -> dict:
+    # Run the in-page bootstrap (ready -> cookies -> play) in one WebDriver round-trip.
+    driver.set_script_timeout(timeout_s + 5.0)
+    return driver.execute_async_script("""
+        const done = arguments[arguments.length - 1];
+        if (!window.__bootstrap) { done({video: false, cookies: false}); return; }
+        window.__bootstrap(arguments[0], arguments[1]).then(done);
+    """, int(timeout_s * 1000), click_cookies) or {}
+
+
 def open_shorts(driver: webdriver.Chrome, behavior: Behavior) -> None:
     # Open YouTube Shorts page and wait for a video element.
     logger.info("Opening YouTube Shorts...")
     driver.get("https://www.youtube.com/shorts")
 
-    time.sleep(rand_range(behavior.page_load_wait_s))
-    wait = WebDriverWait(driver, 20)
-
-    # Try to accept cookies (PT/EN).
-    try:
-        cookie_button = wait.until(
-            EC.element_to_be_clickable((
-                By.XPATH,
-                "//button[contains(., 'Aceitar') or contains(., 'Accept')]"
-            ))
-        )
-        cookie_button.click()
-        time.sleep(1.5)
-    except Exception:
-        pass
+    # The bootstrap returns right after clicking the cookie button; it is then run again (without
+    # clicking) to wait for the video. If the click navigates while that second run is in flight,
+    # the script is dropped ("document unloaded") and retried once. Script timeouts are not retried.
+    cookies = False
+    state: dict = {}
+    retried = False
+    while True:
+        try:
+            state = bootstrap_shorts(driver, timeout_s=20.0, click_cookies=not cookies)
+        except TimeoutException:
+            raise
+        except WebDriverException as e:
+            if retried or "document unloaded" not in str(e):
+                raise
+            retried = True
+            continue
+
+        if state.get("cookies") and not cookies:
+            cookies = True
+            continue
+        break
+
+    if cookies:
+        logger.info("Cookies accepted.")
+    if not state.get("video"):
+        raise TimeoutException("No video element on the Shorts page.")
+
+    # Optional human-like settle time (off by default).
+    if behavior.page_load_pause:
+        time.sleep(rand_range(behavior.page_load_wait_s))
 
-    # Wait for video to appear.
-    wait.until(EC.presence_of_element_located((By.TAG_NAME, "video")))
     logger.info("Shorts loaded.")
 
 
-def ensure_video_playing(driver: webdriver.Chrome) -> None:
-    # Force play (muted).
-    driver.execute_script("""
-        const v = document.querySelector('video');
-        if (v) { v.muted = true; try { v.play(); } catch(e) {} }
-    """)
-
-
-def get_video_duration(driver: webdriver.Chrome) -> float:
+def play_video(driver: webdriver.Chrome) -> float:
+    # Force play (muted) and read the duration in the same round-trip.
     duration = driver.execute_script("""
         const v = document.querySelector('video');
-        return v ? v.duration : 0;
+        if (!v) { return 0; }
+        v.muted = true;
+        try { const p = v.play(); if (p) { p.catch(() => {}); } } catch(e) {}
+        return v.duration;
     """)
     try:
         return float(duration) if duration else 0.0
@@ -172,11 +320,24 @@ def get_video_duration(driver: webdriver.Chrome) -> float:
         return 0.0
 
 
-def get_video_current_time(driver: webdriver.Chrome) -> float:
-    current = driver.execute_script("""
-        const v = document.querySelector('video');
-        return v ? v.currentTime : 0;
-    """)
+def wait_video_end(driver: webdriver.Chrome, duration: float, max_wait: float) -> float:
+    # Poll currentTime inside the browser and return once (one WebDriver round-trip per short).
+    driver.set_script_timeout(max_wait + 5.0)
+    current = driver.execute_async_script("""
+        const duration = arguments[0];
+        const maxWait = arguments[1];
+        const done = arguments[arguments.length - 1];
+        // performance.now() is monotonic (not affected by wall-clock/NTP adjustments).
+        const t0 = performance.now();
+        const poll = setInterval(() => {
+            const v = document.querySelector('video');
+            const current = v ? v.currentTime : 0;
+            if (current >= duration - 0.5 || (performance.now() - t0) / 1000 > maxWait) {
+                clearInterval(poll);
+                done(current);
+            }
+        }, 250);
+    """, duration, max_wait)
     try:
         return float(current) if current else 0.0
     except Exception:
@@ -190,9 +351,7 @@ def next_short(driver: webdriver.Chrome) -> None:
 
 def watch_short(driver: webdriver.Chrome, behavior: Behavior, mode: str) -> None:
     # Watch a short (half or full).
-    ensure_video_playing(driver)
-
-    duration = get_video_duration(driver)
+    duration = play_video(driver)
     if duration <= 0 or duration > behavior.max_duration_s:
         duration = behavior.fallback_duration_s
 
@@ -202,47 +361,45 @@ def watch_short(driver: webdriver.Chrome, behavior: Behavior, mode: str) -> None
         time.sleep(t)
         return
 
-    # Full watch: loop by currentTime.
+    # Full watch: wait (in the browser) until currentTime reaches the end.
     logger.info("  Watch (full) ~%.1fs", duration)
-    start = time.time()
     max_wait = duration + behavior.full_watch_grace_s
 
-    while True:
-        if get_video_current_time(driver) >= duration - 0.5:
-            break
-        if time.time() - start > max_wait:
-            break
-        time.sleep(1.0)
+    try:
+        wait_video_end(driver, duration, max_wait)
+    except TimeoutException:
+        pass
 
 
-def simulate_shorts(cycle_shorts: int, behavior: Behavior, headless: bool, chromedriver_path: Optional[str]) -> None:
-    driver = build_driver(headless=headless, chromedriver_path=chromedriver_path)
+def plan_shorts(cycle_shorts: int, behavior: Behavior) -> List[Optional[str]]:
+    # Draw all watch/skip decisions for a cycle up front: "half", "full" or None (skip).
+    watch = [random.random() < behavior.watch_probability for _ in range(cycle_shorts)]
+    half = [random.random() < behavior.half_watch_probability for _ in range(cycle_shorts)]
+    return [("half" if h else "full") if w else None for w, h in zip(watch, half)]
 
-    try:
-        open_shorts(driver, behavior)
-        maybe_idle(behavior)
 
-        for i in range(cycle_shorts):
-            logger.info("Short %d/%d", i + 1, cycle_shorts)
+def simulate_shorts(driver: webdriver.Chrome, cycle_shorts: int, behavior: Behavior) -> None:
+    plan = plan_shorts(cycle_shorts, behavior)
+    watched = sum(1 for mode in plan if mode is not None)
+    logger.info("Plan: %d watch (%d half) / %d skip", watched, plan.count("half"), cycle_shorts - watched)
 
-            # Decide watch vs skip.
-            do_watch = (random.random() < behavior.watch_probability)
+    open_shorts(driver, behavior)
+    maybe_idle(behavior)
 
-            if do_watch:
-                mode = "half" if (random.random() < behavior.half_watch_probability) else "full"
-                watch_short(driver, behavior, mode)
-            else:
-                logger.info("  Skip")
+    for i, mode in enumerate(plan):
+        logger.info("Short %d/%d", i + 1, cycle_shorts)
 
-            # Move to next.
-            next_short(driver)
-            time.sleep(rand_range(behavior.between_actions_s))
-            maybe_idle(behavior)
+        if mode is not None:
+            watch_short(driver, behavior, mode)
+        else:
+            logger.info("  Skip")
 
-        logger.info("Shorts simulation finished.")
+        # Move to next.
+        next_short(driver)
+        time.sleep(rand_range(behavior.between_actions_s))
+        maybe_idle(behavior)
 
-    finally:
-        driver.quit()
+    logger.info("Shorts simulation finished.")
 
 
 # CLI.
@@ -254,6 +411,7 @@ def parse_args() -> argparse.Namespace:
     # Core capture options.
     parser.add_argument("-i", "--interface", default="enp0s8", help="Network interface to sniff (e.g., enp0s8)")
     parser.add_argument("--filter", default="udp port 1194", help="BPF filter (default: 'udp port 1194')")
+    parser.add_argument("--snaplen", type=int, default=0, help="Bytes kept per packet, e.g. 96 for headers only (default: 0 = full packet)")
     parser.add_argument("-c", "--cycles", type=int, default=5, help="Number of capture cycles (default: 5)")
     parser.add_argument("-p", "--shorts", type=int, default=20, help="Number of Shorts per cycle (default: 20)")
 
@@ -264,11 +422,14 @@ def parse_args() -> argparse.Namespace:
     # Selenium options.
     parser.add_argument("--headless", action="store_true", help="Run Chrome in headless mode")
     parser.add_argument("--chromedriver-path", default=None, help="Custom chromedriver path (optional)")
+    parser.add_argument("--block-images", action="store_true", help="Disable image loading in Chrome (thumbnails, avatars)")
+    parser.add_argument("--restart-browser-every", type=int, default=0, help="Restart Chrome every N cycles (default: 0 = reuse for all cycles)")
 
     # Behavior knobs.
     parser.add_argument("--watch-prob", type=float, default=0.35, help="Probability (0..1) of watching a Short (default: 0.35)")
     parser.add_argument("--half-watch-prob", type=float, default=0.45, help="Probability (0..1) of half-watch when watching (default: 0.45)")
     parser.add_argument("--max-duration", type=float, default=120.0, help="Max duration clamp in seconds (default: 120)")
+    parser.add_argument("--page-load-pause", action="store_true", help="Add a random 2-4.5s pause after Shorts load (human-like settle time)")
     parser.add_argument("--fallback-duration", type=float, default=30.0, help="Fallback duration if video duration is invalid (default: 30)")
 
     return parser.parse_args()
@@ -288,39 +449,63 @@ def main() -> None:
         half_watch_probability=max(0.0, min(1.0, args.half_watch_prob)),
         max_duration_s=max(5.0, args.max_duration),
         fallback_duration_s=max(5.0, args.fallback_duration),
+        page_load_pause=args.page_load_pause,
     )
 
+    listen_socket = open_capture_socket(args.interface, args.filter)
+    driver: Optional[webdriver.Chrome] = None
+    capture_thread: Optional[threading.Thread] = None
+
+    # One timestamp per run; cycles are told apart by their index.
+    session_ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+
     try:
         for c in range(args.cycles):
             logger.info("=" * 60)
             logger.info("Cycle %d/%d", c + 1, args.cycles)
             logger.info("=" * 60)
 
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            pcap_path = os.path.join(args.outdir, f"{args.prefix}_{timestamp}_c{c+1:03d}.pcap")
+            pcap_path = os.path.join(args.outdir, f"{args.prefix}_{session_ts}_c{c+1:03d}.pcap")
 
             stop_capture_flag.clear()
+            capture_ready_flag.clear()
 
             capture_thread = threading.Thread(
                 target=capture_packets,
-                args=(args.interface, pcap_path, args.filter),
-                daemon=True,
+                args=(listen_socket, pcap_path, args.snaplen),
+                daemon=False,  # Non-daemon: the PCAP must be flushed/closed before the process exits.
             )
             capture_thread.start()
 
-            # Ensure capture is active.
-            time.sleep(2)
+            # Chrome is reused across cycles; (re)starting it overlaps with the capture thread start.
+            restart_due = args.restart_browser_every > 0 and c > 0 and c % args.restart_browser_every == 0
+            if driver is not None and restart_due:
+                logger.info("Restarting Chrome...")
+                driver.quit()
+                driver = None
+            if driver is None:
+                driver = build_driver(
+                    headless=args.headless,
+                    chromedriver_path=args.chromedriver_path,
+                    block_images=args.block_images,
+                )
 
-            simulate_shorts(
-                cycle_shorts=args.shorts,
-                behavior=behavior,
-                headless=args.headless,
-                chromedriver_path=args.chromedriver_path,
-            )
+            # Ensure capture is active before opening YouTube.
+            if not capture_ready_flag.wait(timeout=10):
+                logger.warning("Capture thread not ready yet, continuing anyway.")
+
+            simulate_shorts(driver=driver, cycle_shorts=args.shorts, behavior=behavior)
+
+            # Leave YouTube so the player does not keep streaming between cycles.
+            driver.get("about:blank")
 
             stop_capture_flag.set()
             logger.info("Waiting capture thread to finish...")
-            capture_thread.join()
+            if join_capture_thread(capture_thread):
+                # Starting another cycle would clear the stop flag and let the old thread keep
+                # writing into this cycle's pcap while racing the new one for packets.
+                raise RuntimeError(f"Capture thread for cycle {c + 1} did not stop, aborting run.")
+            capture_thread = None
 
             logger.info("✓ Cycle %d completed successfully!", c + 1)
 
@@ -336,6 +521,16 @@ def main() -> None:
         stop_capture_flag.set()
 
     finally:
+        # Stop and join capture before closing the socket it reads from.
+        stop_capture_flag.set()
+        capture_alive = capture_thread is not None and join_capture_thread(capture_thread)
+        if driver is not None:
+            driver.quit()
+        if capture_alive:
+            # The capture thread is non-daemon: a normal return would block at interpreter exit.
+            logger.error("Capture thread is stuck, exiting without closing its socket.")
+            os._exit(1)
+        listen_socket.close()
         logger.info("Done.")
 
 